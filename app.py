@@ -3,12 +3,34 @@ import pandas as pd
 import requests
 import plotly.graph_objects as go
 from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import time
+import json
 import sqlite3
+import threading
+import weakref
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from json import JSONDecodeError
 import numpy as np  # Added for floating-point comparison
+from requests.adapters import HTTPAdapter
+from region_export import pack_region, load_region, export_region
+
+# Encodages de réponse acceptés : brotli n'est décodé que si le paquet est installé
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Format binaire FlatBuffers de l'API, utilisé si le SDK Open-Meteo est installé
+try:
+    from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+except ImportError:
+    WeatherApiResponse = None
 
 # Configuration de la page
 st.set_page_config(
@@ -87,6 +109,29 @@ c.execute("INSERT OR IGNORE INTO users (username, password) VALUES ('membre', 'c
 conn.commit()
 conn.close()
 
+# Base des séries saisonnières, versionnées par date d'émission
+SEASONAL_DB = 'forecasts.db'
+conn = sqlite3.connect(SEASONAL_DB)
+c = conn.cursor()
+c.execute('''
+    CREATE TABLE IF NOT EXISTS seasonal_series (
+        latitude REAL,
+        longitude REAL,
+        date TEXT,
+        issue_date TEXT,
+        tmax REAL,
+        tmin REAL,
+        precip REAL,
+        fetched_on TEXT,
+        PRIMARY KEY (latitude, longitude, issue_date, date)
+    )
+''')
+# Date de téléchargement de chaque jour, absente des bases antérieures
+if 'fetched_on' not in [row[1] for row in c.execute("PRAGMA table_info(seasonal_series)")]:
+    c.execute("ALTER TABLE seasonal_series ADD COLUMN fetched_on TEXT")
+conn.commit()
+conn.close()
+
 # Fonction d'authentification
 def authenticate(username, password):
     conn = sqlite3.connect('users.db')
@@ -151,6 +196,7 @@ else:
             - Sélection de la période (jours fixes ou plage personnalisée)
             2. **Prévisions saisonnières (45 jours à 9 mois)**
             - Analyse des tendances climatiques sur des périodes prolongées
+            - Rafraîchissement incrémental (optionnel) : seuls les jours nouveaux ou révisés depuis l'émission précédente sont téléchargés, avec un rapport des écarts ; l'horizon complet est retéléchargé dès qu'une valeur reprise date de plus de 7 jours
             3. **Projections climatiques (jusqu’à 2050)**
             - Simulation des changements climatiques à long terme
             - Sélection du **modèle climatique** utilisé
@@ -186,13 +232,15 @@ else:
 
             ### Formats d'export
             - Excel : Un fichier par région dans un dossier "Result/[Type_Date_Heure]", avec blocs ordonnés si > 300 localités.
+            - Cube NumPy : `cube.npy` (stations × dates × variables, float32) avec `cube_stations.csv` et `cube_dates.npy`, consultable sans rechargement dans "🗂 Historique des exécutions".
             """)
 
         with st.expander("## 🚀 Déploiement", expanded=False):
             st.markdown("""
             ### Prérequis
             - Python 3.8+
-            - Librairies : `streamlit pandas requests plotly openpyxl xlsxwriter`
+            - Librairies : `streamlit pandas requests plotly openpyxl xlsxwriter brotli openmeteo-sdk`
+            - `brotli` permet les réponses compressées brotli et `openmeteo-sdk` active le format binaire FlatBuffers de l'API ; sans eux, l'application revient au JSON compressé gzip
 
             ### Installation
             ```bash
@@ -237,7 +285,8 @@ else:
         
         df = pd.DataFrame({
             "Localite": localite,
-            "Date": pd.to_datetime(time_data),
+            # Unité unique quel que soit le format de réponse (JSON ou FlatBuffers)
+            "Date": pd.to_datetime(time_data).astype("datetime64[ns]"),
             "Latitude": lat,
             "Longitude": lon
         })
@@ -270,6 +319,281 @@ else:
         
         return error_mapping.get(status_code, error_message)
 
+    # Délais de connexion et de lecture des requêtes API, en secondes
+    REQUEST_TIMEOUT = (10, 120)
+    # Tentatives par requête API et attente après une réponse 429, en secondes
+    API_MAX_RETRIES = 3
+    API_RETRY_DELAY = 60
+    # Attente maximale d'une requête identique en cours : pire cas de la session qui interroge l'API, plus une marge
+    API_WAIT_TIMEOUT = API_MAX_RETRIES * (sum(REQUEST_TIMEOUT) + API_RETRY_DELAY) + 30
+
+    class SharedResultCache:
+        """Cache de résultats API partagé entre toutes les sessions du processus.
+
+        Les entrées sont indexées par les paramètres de requête normalisés et
+        évincées selon l'ordre LRU au-delà de ``max_bytes`` ou après ``ttl``
+        secondes. Les requêtes identiques en cours sont coalescées : une seule
+        session interroge l'API, les autres attendent son résultat au plus
+        ``wait_timeout`` secondes avant d'interroger l'API elles-mêmes.
+        Les données renvoyées sont partagées et ne doivent pas être modifiées.
+        """
+
+        def __init__(self, max_bytes=256 * 1024 * 1024, ttl=3600, wait_timeout=API_WAIT_TIMEOUT):
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            self.wait_timeout = wait_timeout
+            self._lock = threading.Lock()
+            self._entries = OrderedDict()  # clé -> (horodatage, taille, données)
+            self._inflight = {}  # clé -> threading.Event
+            self._size = 0
+
+        @staticmethod
+        def make_key(endpoint, params):
+            """Normalise les paramètres de requête en une clé hachable"""
+            items = []
+            for name, value in sorted(params.items()):
+                if name in ("latitude", "longitude"):
+                    # L'ordre des coordonnées détermine l'ordre des réponses
+                    value = tuple(f"{float(v):.5f}" for v in value)
+                elif isinstance(value, (list, tuple)):
+                    value = tuple(sorted(str(v) for v in value))
+                else:
+                    value = str(value)
+                items.append((name, value))
+            return (endpoint, tuple(items))
+
+        def _evict(self, key):
+            _, size, _ = self._entries.pop(key)
+            self._size -= size
+
+        def _store(self, key, data, size):
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (time.time(), size, data)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+        def get_or_fetch(self, key, fetch):
+            """Renvoie les données en cache ou appelle ``fetch``.
+
+            ``fetch`` renvoie un couple ``(données, taille en mémoire)`` ; un
+            résultat ``None`` n'est pas mis en cache.
+            """
+            while True:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        if time.time() - entry[0] < self.ttl:
+                            self._entries.move_to_end(key)
+                            return entry[2]
+                        self._evict(key)
+                    event = self._inflight.get(key)
+                    if event is None:
+                        event = threading.Event()
+                        self._inflight[key] = event
+                        break
+                # Une autre session récupère déjà ces données : attendre son résultat
+                if not event.wait(self.wait_timeout):
+                    # Requête bloquée : interroger l'API sans attendre davantage
+                    data, size = fetch()
+                    if data is not None:
+                        with self._lock:
+                            self._store(key, data, size)
+                    return data
+
+            data = None
+            try:
+                data, size = fetch()
+            finally:
+                with self._lock:
+                    if data is not None:
+                        self._store(key, data, size)
+                    del self._inflight[key]
+                    event.set()
+            return data
+
+    @st.cache_resource
+    def get_result_cache():
+        """Instance unique du cache, partagée par toutes les sessions"""
+        return SharedResultCache()
+
+    class ApiTransport:
+        """Session HTTP partagée : connexions persistantes et réponses compressées"""
+
+        def __init__(self, pool_size=16):
+            self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            self.session = requests.Session()
+            self.session.mount("https://", self._adapter)
+            self.session.mount("http://", self._adapter)
+            self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+            self._lock = threading.Lock()
+            self._served = weakref.WeakKeyDictionary()  # connexion urllib3 -> requêtes servies
+
+        def get(self, endpoint, params, stats):
+            """Envoie une requête GET et comptabilise le transfert dans stats"""
+            # Réponse en flux : la connexion reste attachée jusqu'à la lecture du contenu
+            response = self.session.get(endpoint, params=params, timeout=REQUEST_TIMEOUT, stream=True)
+            connection = getattr(response.raw, "connection", None)
+            reused = False
+            if connection is not None:
+                with self._lock:
+                    served = self._served.get(connection, 0)
+                    self._served[connection] = served + 1
+                reused = served > 0
+            content = response.content
+            stats["requests"] += 1
+            stats["reused_connections"] += reused
+            stats["wire_bytes"] += response.raw.tell() or int(response.headers.get("Content-Length", len(content)))
+            stats["decoded_bytes"] += len(content)
+            return response
+
+    @st.cache_resource
+    def get_api_transport():
+        """Instance unique du transport, partagée par toutes les sessions"""
+        return ApiTransport()
+
+    def new_transport_stats():
+        """Compteurs de transfert d'une exécution"""
+        return {"requests": 0, "reused_connections": 0, "wire_bytes": 0, "decoded_bytes": 0, "cache_hits": 0}
+
+    def decode_flatbuffers(content, daily_variables):
+        """Décode une réponse FlatBuffers en structure équivalente à la réponse JSON.
+
+        Chaque localité est un message préfixé par sa longueur sur 4 octets ;
+        les séries journalières sont renvoyées sous forme de tableaux NumPy.
+        """
+        forecasts = []
+        position = 0
+        while position < len(content):
+            length = int.from_bytes(content[position:position + 4], "little")
+            response = WeatherApiResponse.GetRootAs(content, position + 4)
+            daily = response.Daily()
+            if daily is None:
+                raise ValueError("séries journalières absentes")
+            if daily.VariablesLength() < len(daily_variables):
+                raise ValueError("variables journalières manquantes")
+
+            # En-tête validé avant toute allocation : pas positif et nombre de pas cohérent avec les valeurs
+            interval = daily.Interval()
+            if interval <= 0 or daily.TimeEnd() < daily.Time():
+                raise ValueError("intervalle de temps invalide")
+            n_steps = (daily.TimeEnd() - daily.Time()) // interval
+            if any(daily.Variables(i).ValuesLength() != n_steps for i in range(len(daily_variables))):
+                raise ValueError("nombre de valeurs incohérent avec l'intervalle de temps")
+
+            times = daily.Time() + interval * np.arange(n_steps) + response.UtcOffsetSeconds()
+            series = {"time": times.astype("datetime64[s]").astype("datetime64[D]")}
+            for i, name in enumerate(daily_variables):
+                # Valeurs float32 arrondies comme dans la réponse JSON
+                series[name] = np.round(daily.Variables(i).ValuesAsNumpy().astype(np.float64), 2)
+            forecasts.append({"daily": series})
+            position += length + 4
+        return forecasts
+
+    def daily_to_arrays(data):
+        """Convertit les séries journalières de la réponse en tableaux NumPy.
+
+        Les listes JSON occupent plusieurs fois leur taille en octets une fois
+        décodées ; les tableaux permettent au cache de borner la mémoire réelle.
+        Renvoie une estimation de la taille en mémoire de la réponse.
+        """
+        forecasts = data if isinstance(data, list) else [data]
+        nbytes = 0
+        for forecast in forecasts:
+            nbytes += 1024  # métadonnées de la localité
+            daily = forecast.get("daily") if isinstance(forecast, dict) else None
+            if not isinstance(daily, dict):
+                continue
+            for name, values in daily.items():
+                if name == "time":
+                    try:
+                        values = np.asarray(values, dtype="datetime64[D]")
+                    except ValueError:
+                        values = np.asarray(values)
+                else:
+                    values = np.asarray(values, dtype=np.float64)
+                daily[name] = values
+                nbytes += values.nbytes
+        return nbytes
+
+    def fetch_api(endpoint, params, stats):
+        """Interroge l'API en passant par le cache partagé.
+
+        Renvoie ``None`` en cas d'erreur API et lève ``RuntimeError`` lorsque
+        le nombre maximal de tentatives est atteint.
+        """
+        def fetch():
+            transport = get_api_transport()
+            request_params = dict(params)
+            if WeatherApiResponse is not None:
+                request_params["format"] = "flatbuffers"
+
+            for attempt in range(API_MAX_RETRIES):
+                last_attempt = attempt == API_MAX_RETRIES - 1
+                try:
+                    response = transport.get(endpoint, request_params, stats)
+                except requests.exceptions.RequestException as e:
+                    st.write(f"Échec de la connexion à l'API ({e.__class__.__name__})")
+                    if not last_attempt:
+                        # Attente croissante avant la tentative suivante
+                        backoff = 5 * 2 ** attempt
+                        st.write(f"Nouvelle tentative dans {backoff} secondes...")
+                        time.sleep(backoff)
+                    continue
+                if response.status_code == 200:
+                    if WeatherApiResponse is not None:
+                        try:
+                            data = decode_flatbuffers(response.content, params["daily"])
+                        except Exception as e:
+                            st.error(f"Réponse API invalide (FlatBuffers) : {str(e)}")
+                            return None, 0
+                        return data, daily_to_arrays(data)
+                    try:
+                        data = response.json()
+                    except JSONDecodeError:
+                        st.error("Réponse API invalide (non JSON)")
+                        return None, 0
+                    return data, daily_to_arrays(data)
+                elif response.status_code == 429:  # Too Many Requests
+                    if not last_attempt:
+                        st.write("En attente d'une retransmission, veuillez patienter...")
+                        time.sleep(API_RETRY_DELAY)
+                else:
+                    try:
+                        error_data = response.json()
+                    except JSONDecodeError:
+                        error_data = None
+                    st.error(get_api_error(error_data, response.status_code))
+                    return None, 0
+            raise RuntimeError("Nombre maximal de tentatives atteint. Veuillez réessayer plus tard.")
+
+        cache = get_result_cache()
+        requests_before = stats["requests"]
+        data = cache.get_or_fetch(SharedResultCache.make_key(endpoint, params), fetch)
+        if stats["requests"] == requests_before:
+            stats["cache_hits"] += 1
+        return data
+
+    @st.cache_resource
+    def get_export_pool():
+        """Pool de processus partagé pour le post-traitement et l'export des régions"""
+        return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+    def submit_export(*args):
+        """Soumet un export de région au pool, en le recréant s'il est hors service"""
+        pool = get_export_pool()
+        try:
+            return pool, pool.submit(export_region, *args)
+        except BrokenProcessPool:
+            # Un processus du pool s'est arrêté (mémoire insuffisante...) : repartir d'un pool neuf
+            get_export_pool.clear()
+            pool.shutdown(wait=False)
+            pool = get_export_pool()
+            return pool, pool.submit(export_region, *args)
+
     def add_metadata(df, mode, params):
         """Ajoute les métadonnées de prévision"""
         df["Type de prévision"] = mode
@@ -279,6 +603,184 @@ else:
             df["Durée prévision"] = params["duration"]
         return df
 
+    # Colonnes des séries saisonnières et leur nom dans la base
+    SEASONAL_COLUMNS = {
+        "Température max (°C)": "tmax",
+        "Température min (°C)": "tmin",
+        "Précipitations (mm)": "precip"
+    }
+    # Nombre de jours en fin de série précédente re-téléchargés pour capter les révisions
+    SEASONAL_REVISION_DAYS = 14
+    # Âge maximal, en jours, d'une valeur reprise d'une émission précédente
+    SEASONAL_MAX_AGE_DAYS = 7
+
+    def load_previous_seasonal(latitudes, longitudes, issue_date):
+        """Charge la dernière émission antérieure à issue_date pour chaque station"""
+        stations = list(zip(map(float, latitudes), map(float, longitudes)))
+        placeholders = ", ".join(["(?, ?)"] * len(stations))
+        query = f"""
+            SELECT s.latitude, s.longitude, s.date, s.tmax, s.tmin, s.precip, s.fetched_on
+            FROM seasonal_series s
+            JOIN (
+                SELECT latitude, longitude, MAX(issue_date) AS issue_date
+                FROM seasonal_series
+                WHERE issue_date < ? AND (latitude, longitude) IN (VALUES {placeholders})
+                GROUP BY latitude, longitude
+            ) last USING (latitude, longitude, issue_date)
+        """
+        params = [issue_date.isoformat()] + [value for station in stations for value in station]
+        conn = sqlite3.connect(SEASONAL_DB)
+        previous = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+
+        previous = previous.rename(columns={"latitude": "Latitude", "longitude": "Longitude", "date": "Date"})
+        previous = previous.rename(columns={db: col for col, db in SEASONAL_COLUMNS.items()})
+        previous["Date"] = pd.to_datetime(previous["Date"]).astype("datetime64[ns]")
+        previous["fetched_on"] = pd.to_datetime(previous["fetched_on"]).astype("datetime64[ns]")
+        return previous.astype({col: float for col in SEASONAL_COLUMNS})
+
+    def seasonal_window(previous, n_stations, issue_date, horizon_end):
+        """Détermine le premier jour à télécharger pour un bloc de stations.
+
+        Sans émission précédente complète pour toutes les stations du bloc,
+        ou si une valeur à reprendre a été téléchargée il y a plus de
+        SEASONAL_MAX_AGE_DAYS jours, tout l'horizon est téléchargé. Sinon,
+        seuls les jours au-delà de la série précédente et ses
+        SEASONAL_REVISION_DAYS derniers jours le sont.
+        """
+        if previous.empty:
+            return issue_date
+        by_station = previous.groupby(["Latitude", "Longitude"])["Date"]
+        if by_station.ngroups < n_stations or (by_station.min() > pd.Timestamp(issue_date)).any():
+            return issue_date
+
+        start = (by_station.max().min() - pd.Timedelta(days=SEASONAL_REVISION_DAYS - 1)).date()
+        start = max(issue_date, min(start, horizon_end - timedelta(days=SEASONAL_REVISION_DAYS - 1)))
+
+        # Les valeurs reprises ne doivent pas être trop anciennes
+        carried = previous[(previous["Date"] >= pd.Timestamp(issue_date)) & (previous["Date"] < pd.Timestamp(start))]
+        oldest = pd.Timestamp(issue_date - timedelta(days=SEASONAL_MAX_AGE_DAYS))
+        if carried["fetched_on"].isna().any() or (carried["fetched_on"] < oldest).any():
+            return issue_date
+        return start
+
+    def merge_seasonal_update(previous, fetched, issue_date, window_start):
+        """Fusionne la fenêtre téléchargée avec la série précédente.
+
+        Renvoie la série complète de la nouvelle émission, avec la date de
+        téléchargement de chaque jour (colonne fetched_on), et le tableau des
+        jours nouveaux ou révisés par rapport à l'émission précédente.
+        """
+        keys = ["Latitude", "Longitude", "Date"]
+        value_columns = list(SEASONAL_COLUMNS)
+        issue, start = pd.Timestamp(issue_date), pd.Timestamp(window_start)
+        fetched = fetched.astype({col: float for col in value_columns})
+
+        # Jours antérieurs à la fenêtre : repris de l'émission précédente
+        names = fetched.drop_duplicates(["Latitude", "Longitude"])[["Latitude", "Longitude", "Localite"]]
+        carried = previous[(previous["Date"] >= issue) & (previous["Date"] < start)].merge(names, on=["Latitude", "Longitude"])
+        merged = fetched.assign(fetched_on=issue).astype({"Date": "datetime64[ns]", "fetched_on": "datetime64[ns]"})
+        if not carried.empty:
+            merged = pd.concat([carried[merged.columns], merged], ignore_index=True)
+        merged = merged.sort_values(["Localite", "Date"], ignore_index=True)
+
+        # Écarts entre la fenêtre téléchargée et l'émission précédente
+        diff = fetched.merge(
+            previous[previous["Date"] >= start],
+            on=keys, how="left", suffixes=("", " (précédent)"), indicator=True
+        )
+        revised = np.zeros(len(diff), dtype=bool)
+        for col in value_columns:
+            revised |= ~np.isclose(diff[col], diff[f"{col} (précédent)"], equal_nan=True)
+        is_new = (diff["_merge"] == "left_only").to_numpy()
+        diff["Statut"] = np.where(is_new, "Nouveau", "Révisé")
+        diff = diff[is_new | revised].drop(columns=["_merge", "fetched_on"])
+        return merged, diff
+
+    def save_seasonal_series(df, issue_date):
+        """Enregistre la série d'une émission dans la base saisonnière.
+
+        Pour chaque station, seules cette émission et la précédente sont conservées.
+        """
+        rows = df[["Latitude", "Longitude", "Date"] + list(SEASONAL_COLUMNS) + ["fetched_on"]].copy()
+        rows["Date"] = rows["Date"].dt.strftime("%Y-%m-%d")
+        rows["fetched_on"] = rows["fetched_on"].dt.strftime("%Y-%m-%d")
+        rows.insert(3, "issue_date", issue_date.isoformat())
+        rows = rows.astype(object).where(rows.notna(), None)
+
+        conn = sqlite3.connect(SEASONAL_DB)
+        conn.executemany(
+            "INSERT OR REPLACE INTO seasonal_series VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows.itertuples(index=False, name=None)
+        )
+
+        # Purge des émissions antérieures à la précédente
+        stations = df[["Latitude", "Longitude"]].drop_duplicates()
+        placeholders = ", ".join(["(?, ?)"] * len(stations))
+        conn.execute(
+            f"""
+            DELETE FROM seasonal_series
+            WHERE (latitude, longitude) IN (VALUES {placeholders})
+            AND issue_date < (
+                SELECT MAX(p.issue_date) FROM seasonal_series p
+                WHERE p.latitude = seasonal_series.latitude
+                AND p.longitude = seasonal_series.longitude
+                AND p.issue_date < ?
+            )
+            """,
+            [float(value) for station in stations.itertuples(index=False) for value in station] + [issue_date.isoformat()]
+        )
+        conn.commit()
+        conn.close()
+
+    # Variables du cube station × date × variable de chaque exécution
+    CUBE_VARIABLES = ["Température max (°C)", "Température min (°C)", "Précipitations (mm)"]
+
+    def write_run_cube(df, run_dir, mode):
+        """Écrit les résultats d'une exécution dans un cube float32 mappé en mémoire.
+
+        Le cube (cube.npy) a la forme stations × dates × variables ; les index
+        sont stockés à côté dans cube_stations.csv et cube_dates.npy. Le fichier
+        cube_meta.json, écrit en dernier, marque le cube comme complet.
+        """
+        station_keys = ["Localite", "Latitude", "Longitude"]
+        station_idx = df.groupby(station_keys, sort=False).ngroup().to_numpy()
+        stations = df.drop_duplicates(station_keys)[station_keys + ["Région", "Source"]]
+        dates, date_idx = np.unique(df["Date"].to_numpy().astype("datetime64[D]"), return_inverse=True)
+
+        shape = (len(stations), len(dates), len(CUBE_VARIABLES))
+        cube = np.lib.format.open_memmap(os.path.join(run_dir, "cube.npy"), mode="w+", dtype=np.float32, shape=shape)
+        cube[:] = np.nan
+        cube[station_idx, date_idx, :] = df[CUBE_VARIABLES].to_numpy(dtype=np.float32, na_value=np.nan)
+        cube.flush()
+        del cube
+
+        stations.to_csv(os.path.join(run_dir, "cube_stations.csv"), index=False)
+        np.save(os.path.join(run_dir, "cube_dates.npy"), dates)
+        meta_path = os.path.join(run_dir, "cube_meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"mode": mode, "variables": CUBE_VARIABLES, "shape": shape}, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def open_run_cube(run_dir):
+        """Ouvre le cube d'une exécution en lecture seule, sans le charger en mémoire"""
+        cube = np.load(os.path.join(run_dir, "cube.npy"), mmap_mode="r")
+        stations = pd.read_csv(os.path.join(run_dir, "cube_stations.csv"))
+        dates = np.load(os.path.join(run_dir, "cube_dates.npy"))
+        with open(os.path.join(run_dir, "cube_meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cube, stations, dates, meta
+
+    def slice_run_cube(cube, stations, dates, station, start=None, end=None):
+        """Extrait la série d'une station sur une fenêtre de dates sous forme de DataFrame"""
+        first = 0 if start is None else np.searchsorted(dates, np.datetime64(start, "D"), side="left")
+        last = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, "D"), side="right")
+        values = cube[station, first:last, :]  # vue sur le fichier, sans copie
+        df = pd.DataFrame(values, columns=CUBE_VARIABLES)
+        df.insert(0, "Date", dates[first:last])
+        df.insert(0, "Localite", stations["Localite"].iloc[station])
+        return df
+
     def create_visualization(df, mode):
         """Crée la visualisation adaptée au type de prévision"""
         fig = go.Figure()
@@ -367,12 +869,24 @@ else:
         st.session_state.selected_locations = pd.DataFrame(columns=['localite', 'latitude', 'longitude', 'region', 'source'])
     if 'coordinates' not in st.session_state:
         st.session_state.coordinates = ""
+    if 'selection_version' not in st.session_state:
+        st.session_state.selection_version = 0
 
     # Fonction pour mettre à jour les coordonnées
     def update_coordinates():
-        coords_list = [f"{row['latitude']},{row['longitude']}" for _, row in st.session_state.selected_locations.iterrows()]
+        locations = st.session_state.selected_locations
+        coords_list = locations['latitude'].astype(str) + "," + locations['longitude'].astype(str)
         st.session_state.coordinates = ", ".join(coords_list)
 
+    # Fonction pour supprimer des localités de la sélection
+    def remove_locations(mask):
+        removed = st.session_state.selected_locations[mask]
+        st.session_state.selected_locations = st.session_state.selected_locations[~mask]
+        st.session_state.coordinates_set.difference_update(zip(removed['latitude'], removed['longitude']))
+        # Réinitialise la sélection du tableau, dont les positions ne sont plus valides
+        st.session_state.selection_version += 1
+        update_coordinates()
+
     # Entrée de coordonnées brutes
     with st.expander("📝 Entrer des coordonnées brutes", expanded=True):
         with st.form("raw_coords_form"):
@@ -503,21 +1017,33 @@ else:
         else:
             filtered_locations = st.session_state.selected_locations
 
-        # Afficher le tableau
-        st.dataframe(filtered_locations[['localite', 'latitude', 'longitude', 'region']])
+        # Pagination : seule la page courante est envoyée au navigateur
+        col1, col2 = st.columns(2)
+        with col1:
+            page_size = st.selectbox("Localités par page :", [25, 50, 100, 250], index=1)
+        n_pages = max(1, -(-len(filtered_locations) // page_size))
+        with col2:
+            page = st.number_input("Page :", min_value=1, max_value=n_pages, value=1, step=1)
+        page_locations = filtered_locations.iloc[(page - 1) * page_size:page * page_size]
+        st.caption(f"{len(filtered_locations)} localités - page {page}/{n_pages}")
+
+        # Afficher le tableau avec sélection multiple des lignes
+        selection = st.dataframe(
+            page_locations[['localite', 'latitude', 'longitude', 'region']],
+            hide_index=True,
+            on_select="rerun",
+            selection_mode="multi-row",
+            key=f"selection_table_{st.session_state.selection_version}_{page}_{page_size}"
+        )
 
-        # Boutons de suppression individuelle
-        for index, row in filtered_locations.iterrows():
-            if st.button(f"Supprimer {row['localite']}", key=f"delete_{row['localite']}"):
-                st.session_state.selected_locations = st.session_state.selected_locations[
-                    st.session_state.selected_locations['localite'] != row['localite']
-                ]
-                st.session_state.coordinates_set.remove((row['latitude'], row['longitude']))
-                update_coordinates()
-                st.success(f"Localité {row['localite']} supprimée.")
+        # Suppression groupée des lignes sélectionnées
+        selected_index = page_locations.index[selection.selection.rows]
+        if st.button(f"Supprimer les localités sélectionnées ({len(selected_index)})", disabled=len(selected_index) == 0):
+            remove_locations(st.session_state.selected_locations.index.isin(selected_index))
+            st.rerun()
 
         # Bouton pour supprimer toutes les localités
-        if st.button("Supprimer toutes les localités sélectionnées"):
+        if st.button("Supprimer toutes les localités"):
             st.session_state.selected_locations = pd.DataFrame(columns=['localite', 'latitude', 'longitude', 'region', 'source'])
             st.session_state.coordinates_set = set()
             update_coordinates()
@@ -554,6 +1080,7 @@ else:
                 else:
                     forecast_days = 1
             forecast_length = None
+            incremental_refresh = False
             start_date = None
             end_date = None
             model = None
@@ -562,6 +1089,12 @@ else:
                 "Durée :",
                 ["45 days", "3 months", "6 months", "9 months"]
             )
+            incremental_refresh = st.checkbox(
+                "Rafraîchissement incrémental (jours nouveaux ou révisés uniquement)",
+                False,
+                help="Réutilise la dernière émission enregistrée et ne télécharge que la fin de l'horizon ; "
+                     "l'horizon complet est retéléchargé dès qu'une valeur reprise date de plus de 7 jours"
+            )
             forecast_days = None
             start_date = None
             end_date = None
@@ -588,6 +1121,7 @@ else:
             )
             forecast_days = None
             forecast_length = None
+            incremental_refresh = False
 
         st.write("Paramètres à prédire :")
         temp_max = st.checkbox("Température maximale (2m)", True)
@@ -611,6 +1145,12 @@ else:
                 excel_locations = st.session_state.selected_locations[st.session_state.selected_locations['source'] == 'excel']
                 manual_locations = st.session_state.selected_locations[st.session_state.selected_locations['source'] == 'manuel']
 
+                # Suivi des émissions saisonnières
+                issue_date = now.date()
+                seasonal_diffs = []
+                seasonal_stats = {"fetched_days": 0, "horizon_days": 0}
+                transport_stats = new_transport_stats()
+
                 # Fonction pour traiter les données et générer des fichiers Excel
                 def process_locations(locations, source_name):
                     if locations.empty:
@@ -636,6 +1176,7 @@ else:
 
                     for i in range(0, len(all_blocks), batch_size):
                         batch = all_blocks[i:i + batch_size]
+                        requests_before_batch = transport_stats["requests"]
                         for region, block, block_name in batch:
                             st.write(f"Traitement du bloc : {block_name} ({len(block)} localités)")
 
@@ -665,10 +1206,28 @@ else:
                                 })
                             elif forecast_mode == "Prévisions saisonnières":
                                 endpoint = "https://api.open-meteo.com/v1/forecast"
+                                horizon_days = int(forecast_length.split()[0]) if "days" in forecast_length else int(forecast_length.split()[0]) * 30
                                 base_params.update({
                                     "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"],
-                                    "forecast_days": int(forecast_length.split()[0]) if "days" in forecast_length else int(forecast_length.split()[0]) * 30
+                                    "forecast_days": horizon_days
                                 })
+
+                                # Fenêtre à télécharger : tout l'horizon ou seulement la fin
+                                previous = load_previous_seasonal(base_params["latitude"], base_params["longitude"], issue_date)
+                                window_start = issue_date
+                                horizon_end = issue_date + timedelta(days=horizon_days - 1)
+                                if incremental_refresh:
+                                    n_stations = len(set(zip(base_params["latitude"], base_params["longitude"])))
+                                    window_start = seasonal_window(previous, n_stations, issue_date, horizon_end)
+                                if window_start > issue_date:
+                                    del base_params["forecast_days"]
+                                    base_params.update({
+                                        "start_date": window_start.strftime("%Y-%m-%d"),
+                                        "end_date": horizon_end.strftime("%Y-%m-%d")
+                                    })
+                                window_days = (horizon_end - window_start).days + 1
+                                seasonal_stats["fetched_days"] += window_days * len(block)
+                                seasonal_stats["horizon_days"] += horizon_days * len(block)
                             elif forecast_mode == "Projections climatiques":
                                 endpoint = "https://climate-api.open-meteo.com/v1/climate"
                                 base_params.update({
@@ -678,27 +1237,14 @@ else:
                                     "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"]
                                 })
 
-                            # Appel API avec gestion des erreurs
-                            max_retries = 3
-                            retry_delay = 60  # en secondes
-                            for attempt in range(max_retries):
-                                response = requests.get(endpoint, params=base_params)
-                                if response.status_code == 200:
-                                    try:
-                                        data = response.json()
-                                        break
-                                    except JSONDecodeError:
-                                        st.error("Réponse API invalide (non JSON)")
-                                        break
-                                elif response.status_code == 429:  # Too Many Requests
-                                    st.write("En attente d'une retransmission, veuillez patienter...")
-                                    time.sleep(retry_delay)
-                                else:
-                                    st.error(get_api_error(response.json(), response.status_code))
-                                    break
-                            else:
-                                st.error("Nombre maximal de tentatives atteint. Veuillez réessayer plus tard.")
+                            # Appel API (cache partagé entre sessions) avec gestion des erreurs
+                            try:
+                                data = fetch_api(endpoint, base_params, transport_stats)
+                            except RuntimeError as e:
+                                st.error(str(e))
                                 return []
+                            if data is None:
+                                continue
 
                             dfs = []
                             # Normaliser la réponse API en liste pour une gestion cohérente
@@ -736,6 +1282,13 @@ else:
                             
                             if dfs:  # S'assurer qu'il y a des données avant de concaténer
                                 df_block = pd.concat(dfs, ignore_index=True)
+                                if forecast_mode == "Prévisions saisonnières":
+                                    df_block, df_diff = merge_seasonal_update(previous, df_block, issue_date, window_start)
+                                    save_seasonal_series(df_block, issue_date)
+                                    df_block = df_block.drop(columns="fetched_on")
+                                    df_diff["Région"] = region
+                                    df_diff["Bloc"] = block_name
+                                    seasonal_diffs.append(df_diff)
                                 df_block = add_metadata(df_block, forecast_mode, {
                                     "model": model if forecast_mode == "Projections climatiques" else None,
                                     "duration": forecast_length if forecast_mode == "Prévisions saisonnières" else None
@@ -744,7 +1297,8 @@ else:
                                 df_block["Bloc"] = block_name
                                 all_df_blocks.append(df_block)
                         
-                        if i + batch_size < len(all_blocks):
+                        # Pause de limitation de débit inutile si tout le lot vient du cache partagé
+                        if i + batch_size < len(all_blocks) and transport_stats["requests"] > requests_before_batch:
                             st.write("Attente d'une minute avant de continuer...")
                             time.sleep(60)
 
@@ -756,33 +1310,122 @@ else:
 
                 # Générer les fichiers Excel séparés
                 from collections import defaultdict
-                def export_by_region(df_blocks, source_name):
-                    if not df_blocks:
-                        return
+                def export_by_region(sources):
+                    """Trie et exporte chaque région dans le pool de processus, puis affiche les résultats au fil de l'eau"""
                     df_by_region = defaultdict(list)
-                    for df_block in df_blocks:
-                        region = df_block["Région"].iloc[0]
-                        df_by_region[region].append(df_block)
-
-                    for region, df_list in df_by_region.items():
-                        df_region_all = pd.concat(df_list, ignore_index=True)
-                        df_region_all = df_region_all.sort_values(by=["Bloc", "Localite"])
-
-                        # Visualisation
-                        fig = create_visualization(df_region_all, forecast_mode)
-                        st.subheader(f"Prévisions pour la région : {region} ({source_name})")
-                        st.plotly_chart(fig, use_container_width=True)
-                        
-                        # Exporter en Excel
-                        output = BytesIO()
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            df_region_all.to_excel(writer, index=False, sheet_name=region)
+                    for df_blocks, source_name in sources:
+                        for df_block in df_blocks:
+                            region = df_block["Région"].iloc[0]
+                            df_by_region[(region, source_name)].append(df_block)
+                    if not df_by_region:
+                        return
+
+                    # Les colonnes transitent par fichier tampon mappé en mémoire plutôt que par
+                    # sérialisation ; au plus un tampon par processus du pool est préparé à la fois
+                    regions = iter(df_by_region.items())
+                    futures = {}
+                    buffers = []
+
+                    def submit_next_region():
+                        item = next(regions, None)
+                        if item is None:
+                            return None
+                        (region, source_name), df_list = item
                         file_name = f"{region}_{source_name}.xlsx"
                         file_path = os.path.join(result_dir, file_name)
-                        with open(file_path, "wb") as f:
+                        buffer_path = file_path + ".buf"
+                        buffers.append(buffer_path)
+                        layout = pack_region(df_list, buffer_path)
+                        args = (buffer_path, layout, ["Bloc", "Localite"], region, file_path)
+                        pool, future = submit_export(*args)
+                        futures[future] = (region, source_name, file_name, file_path, pool, args)
+                        return future
+
+                    try:
+                        in_flight = {submit_next_region() for _ in range(min(os.cpu_count() or 1, len(df_by_region)))}
+                        progress = st.progress(0.0, text="Export des régions...")
+                        done = 0
+                        while in_flight:
+                            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                region, source_name, file_name, file_path, pool, args = futures[future]
+                                done += 1
+                                progress.progress(done / len(df_by_region), text=f"Régions exportées : {done}/{len(df_by_region)}")
+                                try:
+                                    try:
+                                        future.result()
+                                    except BrokenProcessPool:
+                                        # Nouvelle tentative unique sur un pool neuf
+                                        if get_export_pool() is pool:
+                                            get_export_pool.clear()
+                                            pool.shutdown(wait=False)
+                                        submit_export(*args)[1].result()
+                                    df_region_all = load_region(args[0], args[1], ordered=True)
+
+                                    # Visualisation
+                                    fig = create_visualization(df_region_all, forecast_mode)
+                                    st.subheader(f"Prévisions pour la région : {region} ({source_name})")
+                                    st.plotly_chart(fig, use_container_width=True)
+
+                                    # Lien de téléchargement
+                                    with open(file_path, "rb") as f:
+                                        st.download_button(
+                                            label=f"Télécharger {file_name}",
+                                            data=f.read(),
+                                            file_name=file_name,
+                                            mime="application/vnd.ms-excel"
+                                        )
+                                except Exception as e:
+                                    st.error(f"Export de la région {region} ({source_name}) impossible : {str(e)}")
+                                finally:
+                                    os.remove(args[0])
+
+                                next_future = submit_next_region()
+                                if next_future is not None:
+                                    in_flight.add(next_future)
+                    finally:
+                        # Annuler les exports en attente et laisser finir ceux en cours avant de supprimer les tampons
+                        for future in futures:
+                            future.cancel()
+                        wait(futures)
+                        for buffer_path in buffers:
+                            if os.path.exists(buffer_path):
+                                os.remove(buffer_path)
+
+                # Bilan des transferts API de l'exécution
+                st.caption(
+                    f"Transfert API : {transport_stats['requests']} requêtes, "
+                    f"{transport_stats['wire_bytes'] / 1024:.0f} Ko reçus "
+                    f"({transport_stats['decoded_bytes'] / 1024:.0f} Ko décompressés), "
+                    f"{transport_stats['reused_connections']}/{transport_stats['requests']} requêtes sur connexion réutilisée, "
+                    f"{transport_stats['cache_hits']} réponses du cache partagé"
+                )
+
+                export_by_region([(excel_blocks, "excel"), (manual_blocks, "manuel")])
+
+                # Cube mappé en mémoire pour les consultations ultérieures
+                run_blocks = [b.assign(Source="excel") for b in excel_blocks] + [b.assign(Source="manuel") for b in manual_blocks]
+                if run_blocks:
+                    write_run_cube(pd.concat(run_blocks, ignore_index=True), result_dir, forecast_mode)
+
+                # Écarts par rapport à l'émission saisonnière précédente
+                if forecast_mode == "Prévisions saisonnières" and seasonal_stats["horizon_days"]:
+                    st.subheader("Écarts avec l'émission précédente")
+                    st.write(
+                        f"Jours téléchargés : {seasonal_stats['fetched_days']} / {seasonal_stats['horizon_days']} "
+                        f"({100 * seasonal_stats['fetched_days'] / seasonal_stats['horizon_days']:.0f} %)"
+                    )
+                    if seasonal_diffs:
+                        df_diff_all = pd.concat(seasonal_diffs, ignore_index=True)
+                        n_new = int((df_diff_all["Statut"] == "Nouveau").sum())
+                        st.write(f"Jours nouveaux : {n_new} — Jours révisés : {len(df_diff_all) - n_new}")
+
+                        output = BytesIO()
+                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+                            df_diff_all.to_excel(writer, index=False, sheet_name="Ecarts")
+                        file_name = f"ecarts_{issue_date.strftime('%Y%m%d')}.xlsx"
+                        with open(os.path.join(result_dir, file_name), "wb") as f:
                             f.write(output.getvalue())
-                        
-                        # Lien de téléchargement
                         st.download_button(
                             label=f"Télécharger {file_name}",
                             data=output.getvalue(),
@@ -790,8 +1433,45 @@ else:
                             mime="application/vnd.ms-excel"
                         )
 
-                export_by_region(excel_blocks, "excel")
-                export_by_region(manual_blocks, "manuel")
-
         except Exception as e:
-            st.error(f"Erreur : {str(e)}")
\ No newline at end of file
+            st.error(f"Erreur : {str(e)}")
+
+    # Consultation des exécutions précédentes à partir de leur cube
+    with st.expander("🗂 Historique des exécutions", expanded=False):
+        run_dirs = []
+        if os.path.isdir("Result"):
+            run_metas = {
+                name: os.path.join("Result", name, "cube_meta.json")
+                for name in os.listdir("Result")
+                if os.path.exists(os.path.join("Result", name, "cube_meta.json"))
+            }
+            # Les plus récentes d'abord, tous types de prévision confondus
+            run_dirs = sorted(run_metas, key=lambda name: os.path.getmtime(run_metas[name]), reverse=True)
+        if not run_dirs:
+            st.write("Aucune exécution disponible.")
+        else:
+            selected_run = st.selectbox("Exécution :", run_dirs)
+            try:
+                cube, cube_stations, cube_dates, cube_meta = open_run_cube(os.path.join("Result", selected_run))
+            except Exception as e:
+                cube = None
+                st.warning(f"Impossible d'ouvrir l'exécution {selected_run} : {str(e)}")
+
+            if cube is not None:
+                station = st.selectbox(
+                    "Localité :",
+                    range(len(cube_stations)),
+                    format_func=lambda i: f"{cube_stations['Localite'].iloc[i]} ({cube_stations['Région'].iloc[i]})"
+                )
+                first_date = pd.Timestamp(cube_dates[0]).date()
+                last_date = pd.Timestamp(cube_dates[-1]).date()
+                history_range = st.date_input(
+                    "Période :",
+                    [first_date, last_date],
+                    min_value=first_date,
+                    max_value=last_date,
+                    key="history_range"
+                )
+                if len(history_range) == 2:
+                    df_station = slice_run_cube(cube, cube_stations, cube_dates, station, history_range[0], history_range[1])
+                    st.plotly_chart(create_visualization(df_station, cube_meta["mode"]), use_container_width=True)
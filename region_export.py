@@ -0,0 +1,91 @@
+"""Post-traitement et export Excel des régions dans des processus séparés.
+
+Les blocs d'une région sont copiés colonne par colonne dans un fichier tampon
+mappé en mémoire ; seul un petit descriptif (positions, types, modalités des
+colonnes texte) est sérialisé vers le processus qui trie et écrit le fichier.
+Le tampon est un fichier ordinaire plutôt qu'un segment de /dev/shm, dont la
+taille est limitée (64 Mo par défaut sous Docker).
+"""
+import numpy as np
+import pandas as pd
+
+
+def pack_region(df_list, buffer_path):
+    """Copie les blocs d'une région dans le fichier tampon buffer_path.
+
+    Les colonnes numériques et de dates sont copiées telles quelles, les autres
+    sous forme de codes entiers. Renvoie le descriptif du tampon.
+    """
+    n_rows = sum(len(df) for df in df_list)
+    columns = []
+    arrays = []
+    offset = 0
+    for col in df_list[0].columns:
+        dtypes = {df[col].dtype for df in df_list}
+        dtype = dtypes.pop() if len(dtypes) == 1 else None
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufmM":
+            values = [df[col].to_numpy() for df in df_list]
+            columns.append((col, "raw", dtype.str, offset, None))
+        else:
+            codes, categories = pd.factorize(np.concatenate([df[col].to_numpy(dtype=object) for df in df_list]))
+            dtype = np.dtype(np.int64)
+            values = [codes]
+            columns.append((col, "codes", dtype.str, offset, list(categories)))
+        arrays.append(values)
+        offset += -(-n_rows * dtype.itemsize // 8) * 8
+
+    # Emplacement de l'ordre de tri, rempli par le processus d'export
+    order_offset = offset
+    offset += n_rows * 8
+
+    buf = np.memmap(buffer_path, dtype=np.uint8, mode="w+", shape=(max(offset, 1),))
+    for (col, kind, dtype_str, col_offset, _), values in zip(columns, arrays):
+        target = np.ndarray(n_rows, dtype=dtype_str, buffer=buf, offset=col_offset)
+        np.concatenate(values, out=target)
+        del target
+    buf.flush()
+    del buf
+    return {"columns": columns, "order": order_offset, "n_rows": n_rows}
+
+
+def unpack_region(buf, layout, ordered=False):
+    """Reconstruit le DataFrame d'une région à partir du tampon buf.
+
+    Les données sont copiées hors du tampon, qui peut être fermé ensuite.
+    Avec ``ordered``, les lignes suivent l'ordre de tri écrit par export_region.
+    """
+    n_rows = layout["n_rows"]
+    data = {}
+    for col, kind, dtype_str, offset, categories in layout["columns"]:
+        values = np.ndarray(n_rows, dtype=dtype_str, buffer=buf, offset=offset).copy()
+        if kind == "codes":
+            # Le code -1 (valeur manquante) pointe sur le None final
+            values = np.array(categories + [None], dtype=object)[values]
+        data[col] = values
+    df = pd.DataFrame(data)
+
+    if ordered:
+        order = np.ndarray(n_rows, dtype=np.int64, buffer=buf, offset=layout["order"]).copy()
+        df = df.take(order)
+    return df
+
+
+def load_region(buffer_path, layout, ordered=False):
+    """Relit une région depuis son fichier tampon"""
+    return unpack_region(np.memmap(buffer_path, dtype=np.uint8, mode="r"), layout, ordered=ordered)
+
+
+def export_region(buffer_path, layout, sort_by, sheet_name, file_path):
+    """Trie une région et l'écrit en Excel ; exécuté dans un processus du pool"""
+    buf = np.memmap(buffer_path, dtype=np.uint8, mode="r+")
+    df = unpack_region(buf, layout)
+    df = df.sort_values(by=sort_by)
+    order = np.ndarray(layout["n_rows"], dtype=np.int64, buffer=buf, offset=layout["order"])
+    order[:] = df.index.to_numpy()
+    del order
+    buf.flush()
+    del buf
+
+    with pd.ExcelWriter(file_path, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return file_path